@@ -2,20 +2,29 @@
 # Full ready-to-run script for multi-account X/Twitter reply bot
 # Features: Fetch tweets via Apify, analyze via Perplexity, reply via multiple accounts with optional media
 # Modification: Fetches from 30 profiles (one each), selects the 10 most recent (by timestamp) from different profiles for replies
-# Optimization: Reduced delays to 1-5s for faster replies; parallel Perplexity calls (via threading) for speed
-# Setup: Fill .env, add profiles.txt (30+ profiles), accounts.json (template), run `python multi_account_twitter_bot.py`
+# Optimization: Reduced delays to 1-5s for faster replies; concurrent Perplexity calls (via asyncio/aiohttp) for speed
+# Setup: `pip install apify-client tweepy python-dotenv aiohttp diskcache orjson` (+ Pillow for ATTACH_MEDIA,
+#        faiss-cpu + sentence-transformers for the semantic cache), fill .env, add profiles.txt (30+ profiles),
+#        accounts.json (template), run `python multi_account_twitter_bot.py`
 
 import os
-import json
+import atexit
+import asyncio
+import hashlib
+import functools
+import heapq
 import random
-import requests
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor  # For parallel account init
+import aiohttp
+import diskcache
+import orjson
 from datetime import datetime
 from apify_client import ApifyClient
 import tweepy
 from dotenv import load_dotenv  # Optional: for .env loading
-from concurrent.futures import ThreadPoolExecutor, as_completed  # For parallel Perplexity
 
 # Load .env if present
 load_dotenv()
@@ -27,8 +36,12 @@ PROFILES_FILE = "profiles.txt"  # List of Twitter profile URLs (one per line)
 ACCOUNTS_FILE = "accounts.json"  # JSON array of account credentials (template: empty or env fallback)
 REPLY_QUEUE_FILE = "reply_queue.json"  # For queuing if needed
 RECENT_PROFILES_FILE = "recent_profiles.json"
-LOG_FILE = "bot_logs.json"
+LOG_FILE = "bot_logs.jsonl"  # Append-only, one JSON object per line
 IMAGES_DIR = "images"  # Folder for media attachments (optional: add JPG/PNG files here)
+OPT_IMAGES_DIR = os.path.join(IMAGES_DIR, "_opt")  # Resized upload copies (generated)
+PPLX_CACHE_DIR = ".pplx_cache"  # On-disk exact-match cache of Perplexity replies
+SEMANTIC_INDEX_FILE = "pplx_cache.faiss"  # FAISS vectors of analyzed tweet texts
+SEMANTIC_CACHE_FILE = "pplx_cache.json"  # Replies aligned with SEMANTIC_INDEX_FILE vectors
 
 # Settings
 ACTOR_ID = "Fo9GoU5wC270BgcBr"
@@ -41,7 +54,22 @@ ATTACH_MEDIA = os.getenv("ATTACH_MEDIA", "false").lower() == "true"  # Toggle me
 MODE = os.environ.get("MODE", "fetch_reply")  # "fetch_reply" or "reply_queue"
 MIN_DELAY = int(os.getenv("MIN_DELAY", 1))  # Min delay in seconds (for faster: 1)
 MAX_DELAY = int(os.getenv("MAX_DELAY", 5))  # Max delay in seconds (for faster: 5)
-MAX_PARALLEL = int(os.getenv("MAX_PARALLEL", 5))  # Max parallel Perplexity calls
+MAX_IMAGE_SIDE = 2048  # Longest side (px) of uploaded images
+IMAGE_QUALITY = 85  # JPEG quality of uploaded images
+APIFY_POLL_INTERVAL = 3  # Seconds between Apify run/dataset polls
+LOG_FLUSH_EVERY = 5  # Flush buffered log entries to LOG_FILE every N actions (and at exit)
+PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
+PPLX_MAX_RETRIES = 2  # Retries on 429/5xx, connection errors and timeouts before giving up
+PPLX_BACKOFF = 0.3  # Base backoff in seconds (doubles per retry)
+PPLX_RETRY_STATUSES = {429, 500, 502, 503, 504}
+PPLX_CONCURRENCY = int(os.getenv("PPLX_CONCURRENCY", REPLIES_TO_PROCESS))  # Max Perplexity calls in flight
+PPLX_MAX_RETRY_AFTER = 60  # Upper bound (seconds) on an honored Retry-After header
+PPLX_CACHE_TTL = 7 * 86400  # Exact-match reply cache expiry in seconds (7 days)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "true").lower() == "true"  # Reuse replies for near-duplicate tweets
+SEMANTIC_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.85  # Min cosine similarity for a cache hit
+SEMANTIC_TTL = PPLX_CACHE_TTL  # Semantic entries expire like exact-match ones
+SEMANTIC_MAX_ENTRIES = 5000  # Keep only the newest N semantic entries
 
 # ---------------- Clients & Accounts ----------------
 apify_client = ApifyClient(APIFY_TOKEN)
@@ -50,8 +78,8 @@ def load_accounts():
     """Load Twitter account credentials from accounts.json or env vars."""
     accounts = []
     if os.path.exists(ACCOUNTS_FILE):
-        with open(ACCOUNTS_FILE, "r") as f:
-            accounts = json.load(f)
+        with open(ACCOUNTS_FILE, "rb") as f:
+            accounts = orjson.loads(f.read())
     # Fallback/Override with env vars (API_KEY_1 to API_KEY_10, etc.)
     env_accounts = []
     for i in range(1, 11):
@@ -75,10 +103,10 @@ def load_accounts():
     print(f"Loaded {len(accounts)} accounts.")
     return accounts[:10]  # Cap at 10
 
-accounts = load_accounts()
-clients = []
 from tweepy import OAuth1UserHandler  # For v1.1 API
-for i, acc in enumerate(accounts):
+
+def build_client(i, acc):
+    """Build v2 Client + v1.1 API for one account; returns None on failure."""
     try:
         # v2 Client
         client = tweepy.Client(
@@ -97,68 +125,159 @@ for i, acc in enumerate(accounts):
             acc["access_secret"]
         )
         api = tweepy.API(auth)
-        clients.append({
+        client_info = {
             "client": client,  # v2 for posting
             "api": api,       # v1.1 for upload
             "name": f"Account_{i+1}"
-        })
-        print(f"✅ Loaded {clients[-1]['name']}")
+        }
+        print(f"✅ Loaded {client_info['name']}")
+        return client_info
     except Exception as e:
         print(f"❌ Failed to load Account_{i+1}: {e}")
+        return None
+
+@functools.cache
+def get_clients():
+    """Load accounts and build their clients on first use (not at import)."""
+    accounts = load_accounts()
+    # Initialize all accounts concurrently; map() keeps Account_N order
+    with ThreadPoolExecutor(max_workers=max(1, min(10, len(accounts)))) as executor:
+        clients = [c for c in executor.map(lambda p: build_client(*p), enumerate(accounts)) if c is not None]
 
-if len(clients) == 0:
-    raise ValueError("No valid Twitter accounts loaded. Check accounts.json or env vars.")
+    if len(clients) == 0:
+        raise ValueError("No valid Twitter accounts loaded. Check accounts.json or env vars.")
+    return clients
 
 # ---------------- Utils ----------------
 def load_json(path):
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
+        with open(path, "rb") as f:
             try:
-                return json.load(f)
+                return orjson.loads(f.read())
             except:
                 return {}
     return {}
 
 def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # orjson writes UTF-8 as-is (no ASCII escaping), matching the old ensure_ascii=False output
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+_CITE_RE = re.compile(r'\[\d+\](?:\[\d+\])*')  # Citation markers like [1][2]
+_WS_RE = re.compile(r'\s+')
+_STOPS = ('।', '.', '!', '?')
+_TAIL_RE = re.compile(r'[।.!?](?=[^।.!?]*$)')  # Last sentence stop, found in one pass
 
 def clean_text(text):
     if not text:
         return ""
-    text = re.sub(r'\[\d+\](?:\[\d+\])*', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = _CITE_RE.sub('', text)
+    text = _WS_RE.sub(' ', text).strip()
     if len(text) > 273:
         trimmed = text[:273]
-        last_stop = max(trimmed.rfind('।'), trimmed.rfind('.'), trimmed.rfind('!'), trimmed.rfind('?'))
+        m = _TAIL_RE.search(trimmed)
+        last_stop = m.start() if m else -1
         if last_stop > 200:
             text = trimmed[:last_stop+1]
         else:
             text = trimmed[:trimmed.rfind(' ')]
-        if text[-1] not in {'।', '.', '?', '!'}:
+        if text[-1] not in _STOPS:
             text += "..."
     return text.strip()
 
+_IMAGE_CACHE = None  # Upload-ready image paths, scanned once on first use
+_IMAGE_LOCK = threading.Lock()  # Guards lazy scans if prepare_images() wasn't called
+
+def optimize_image(path):
+    """Return a resized JPEG copy of path in OPT_IMAGES_DIR, (re)creating it if stale."""
+    name = os.path.basename(path)
+    if not name.lower().endswith(('.jpg', '.jpeg')):
+        name += ".jpg"
+    opt_path = os.path.join(OPT_IMAGES_DIR, name)
+    if os.path.exists(opt_path) and os.path.getmtime(opt_path) >= os.path.getmtime(path):
+        return opt_path
+    try:
+        from PIL import Image, ImageOps  # Optional: only needed when ATTACH_MEDIA=true
+        os.makedirs(OPT_IMAGES_DIR, exist_ok=True)
+        with Image.open(path) as img:
+            # Bake in EXIF rotation; the re-encoded JPEG drops the Orientation tag
+            img = ImageOps.exif_transpose(img)
+            if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+                # Flatten transparency onto white; a plain convert("RGB") turns it black
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                img = img.convert("RGB")
+            img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+            img.save(opt_path, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+        return opt_path
+    except Exception as e:
+        print(f"⚠️ Could not optimize {path}: {e}; uploading original.")
+        return path
+
+def refresh_images():
+    """Re-scan IMAGES_DIR (call in long-running processes after adding images)."""
+    global _IMAGE_CACHE
+    if not os.path.isdir(IMAGES_DIR):
+        _IMAGE_CACHE = []
+    else:
+        _IMAGE_CACHE = [optimize_image(os.path.join(IMAGES_DIR, f)) for f in os.listdir(IMAGES_DIR)
+                        if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    return _IMAGE_CACHE
+
+def prepare_images():
+    """Resize media once at startup, before posting threads start."""
+    if ATTACH_MEDIA:
+        with _IMAGE_LOCK:
+            print(f"🖼️ Prepared {len(refresh_images())} images for upload.")
+
 def get_random_image():
     """Pick a random image from IMAGES_DIR if ATTACH_MEDIA=True."""
-    if not ATTACH_MEDIA or not os.path.exists(IMAGES_DIR):
+    if not ATTACH_MEDIA:
         return None
-    images = [f for f in os.listdir(IMAGES_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    with _IMAGE_LOCK:
+        images = _IMAGE_CACHE if _IMAGE_CACHE is not None else refresh_images()
     if not images:
         print(f"⚠️ No images in {IMAGES_DIR}; skipping media.")
         return None
-    return os.path.join(IMAGES_DIR, random.choice(images))
+    return random.choice(images)
+
+_LOG_LOCK = threading.Lock()  # Accounts post concurrently; keep log lines from interleaving
+_LOG_BUFFER = []
 
 def log_action(action, details):
-    logs = load_json(LOG_FILE)
-    if "logs" not in logs:
-        logs["logs"] = []
-    logs["logs"].append({
-        "action": action,
-        "details": details,
-        "timestamp": datetime.utcnow().isoformat()
-    })
-    save_json(LOG_FILE, logs)
+    with _LOG_LOCK:
+        _LOG_BUFFER.append({
+            "action": action,
+            "details": details,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+        full = len(_LOG_BUFFER) >= LOG_FLUSH_EVERY
+    if full:
+        flush_logs()
+
+def flush_logs():
+    """Write buffered log entries to LOG_FILE in one append."""
+    with _LOG_LOCK:
+        if not _LOG_BUFFER:
+            return
+        with open(LOG_FILE, "ab") as f:
+            f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in _LOG_BUFFER))
+        _LOG_BUFFER.clear()
+
+atexit.register(flush_logs)
+
+def iter_logs():
+    """Lazily yield log entries from LOG_FILE, skipping malformed lines."""
+    if not os.path.exists(LOG_FILE):
+        return
+    with open(LOG_FILE, "rb") as f:
+        for line in f:
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
 
 # ---------------- Profile Handling ----------------
 def get_profiles():
@@ -173,7 +292,8 @@ def get_profiles():
 def select_profiles():
     all_profiles = get_profiles()
     recent = load_json(RECENT_PROFILES_FILE).get("recent", [])
-    candidates = [p for p in all_profiles if p not in recent]
+    recent_set = set(recent)  # O(1) membership; keep list for ordering
+    candidates = [p for p in all_profiles if p not in recent_set]
     if len(candidates) < PROFILES_PER_RUN:
         candidates = all_profiles
     num_to_select = min(PROFILES_PER_RUN, len(candidates))
@@ -184,94 +304,330 @@ def select_profiles():
     return selected
 
 # ---------------- Apify Fetch ----------------
-def fetch_tweets(profiles):
+APIFY_FIELDS = ["postId", "postText", "text", "timestamp", "profileUrl"]  # Only the columns we read
+APIFY_TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"}
+
+async def fetch_and_analyze(profiles):
+    """Stream tweets from a running Apify actor, starting Perplexity analysis as each arrives.
+
+    Returns the REPLIES_TO_PROCESS most recent tweets (one per profile) with "reply_text" set.
+    """
     total_limit = TWEETS_PER_PROFILE * len(profiles)
+    max_items = total_limit * 2  # Cap on dataset rows read
     run_input = {"profileUrls": profiles, "resultsLimit": total_limit}
     print(f"Fetching up to {total_limit} tweets from {len(profiles)} profiles...")
-    run = apify_client.actor(ACTOR_ID).call(run_input=run_input)
+    # Load the embedding model off the loop while the actor starts
+    run, _ = await asyncio.gather(
+        asyncio.to_thread(apify_client.actor(ACTOR_ID).start, run_input=run_input),
+        asyncio.to_thread(load_semantic_cache)
+    )
+    run_client = apify_client.run(run["id"])
+    dataset = apify_client.dataset(run["defaultDatasetId"])
     all_tweets = {}
+    analyses = []  # (tweet, task) for tweets still in the running top REPLIES_TO_PROCESS
+    filled = 0  # Profiles that already have TWEETS_PER_PROFILE tweets
+    seen = 0  # Dataset offset; items are appended while the actor runs
+
+    async with pplx_session() as session:
+        batch = new_pplx_batch(session)
+        while True:
+            # Read status before items so the last pass after a terminal status sees everything
+            status = (await asyncio.to_thread(run_client.get))["status"]
+            items = await asyncio.to_thread(
+                lambda: list(dataset.iterate_items(offset=seen, limit=max_items - seen, fields=APIFY_FIELDS))
+            )
+            seen += len(items)
+            new_tweets = []
+            for item in items:
+                profile = item.get("profileUrl")
+                text = item.get("postText") or item.get("text") or ""
+                timestamp = item.get("timestamp")  # Capture timestamp (ms Unix)
+                if not text:
+                    continue
+                if profile not in all_tweets:
+                    all_tweets[profile] = []
+                if len(all_tweets[profile]) < TWEETS_PER_PROFILE:
+                    tweet = {
+                        "id": item.get("postId"),
+                        "text": text,
+                        "timestamp": timestamp,  # Include for sorting
+                        "profile": profile
+                    }
+                    all_tweets[profile].append(tweet)
+                    new_tweets.append(tweet)
+                    if len(all_tweets[profile]) == TWEETS_PER_PROFILE:
+                        filled += 1
+            # Only analyze tweets that can still make the top REPLIES_TO_PROCESS; tweets pushed out
+            # by newer ones are cancelled (usually while still queued on the concurrency limit)
+            contenders = heapq.nlargest(REPLIES_TO_PROCESS, [t for t, _ in analyses] + new_tweets,
+                                        key=lambda t: t["timestamp"] or 0)
+            keep = {id(t) for t in contenders}
+            for tweet, task in analyses:
+                if id(tweet) not in keep:
+                    task.cancel()
+            analyses = [(tweet, task) for tweet, task in analyses if id(tweet) in keep]
+            new_tweets = [tweet for tweet in new_tweets if id(tweet) in keep]
+            # One encode() per poll, then start analyses; near-duplicates share one call
+            embs = await embed_texts_async([tweet["text"][:500] for tweet in new_tweets])
+            for tweet, emb in zip(new_tweets, embs):
+                task = asyncio.create_task(fetch_perplexity_analysis(tweet["text"], batch, emb))
+                analyses.append((tweet, task))
+            if status in APIFY_TERMINAL_STATUSES or filled >= len(profiles) or seen >= max_items:
+                break
+            await asyncio.sleep(APIFY_POLL_INTERVAL)
+        if status not in APIFY_TERMINAL_STATUSES:
+            await asyncio.to_thread(run_client.abort)  # Got enough; stop paying for the scrape
+        elif status != "SUCCEEDED":
+            print(f"⚠️ Apify run ended with status {status}; using {seen} items fetched.")
+
+        # analyses already holds the top REPLIES_TO_PROCESS (from different profiles); most recent first
+        top = heapq.nlargest(REPLIES_TO_PROCESS, analyses, key=lambda a: a[0]["timestamp"] or 0)
+        results = await asyncio.gather(*[task for _, task in top], return_exceptions=True)
+    await asyncio.to_thread(save_semantic_cache)
 
-    for item in apify_client.dataset(run["defaultDatasetId"]).iterate_items():
-        profile = item.get("profileUrl")
-        text = item.get("postText") or item.get("text") or ""
-        timestamp = item.get("timestamp")  # Capture timestamp (ms Unix)
-        if not text:
-            continue
-        if profile not in all_tweets:
-            all_tweets[profile] = []
-        if len(all_tweets[profile]) < TWEETS_PER_PROFILE:
-            all_tweets[profile].append({
-                "id": item.get("postId"),
-                "text": text,
-                "timestamp": timestamp  # Include for sorting
-            })
-
-    # Flatten to list with profile and timestamp
     fetched_tweets = []
-    for profile, tweets in all_tweets.items():
-        for tweet in tweets[:TWEETS_PER_PROFILE]:
-            fetched_tweets.append({
-                "id": tweet["id"],
-                "text": tweet["text"],
-                "timestamp": tweet["timestamp"],
-                "profile": profile
-            })
-
-    # Sort by timestamp descending (most recent first)
-    fetched_tweets.sort(key=lambda x: x["timestamp"], reverse=True)
-    # Take top REPLIES_TO_PROCESS (10 most recent, from different profiles)
-    fetched_tweets = fetched_tweets[:REPLIES_TO_PROCESS]
+    for (tweet, _), reply in zip(top, results):
+        if isinstance(reply, Exception):
+            print(f"❌ Async Perplexity error for {tweet['id']}: {reply}")
+            reply = ""
+        tweet["reply_text"] = reply
+        fetched_tweets.append(tweet)
     print(f"📊 Fetched {len(fetched_tweets)} most recent tweets from {len(all_tweets)} profiles.")
     return fetched_tweets
 
+# ---------------- Reply Caches ----------------
+@functools.cache
+def get_pplx_cache():
+    """Exact-match cache, sha1(tweet text) -> reply; opened on first use so import writes nothing."""
+    return diskcache.Cache(PPLX_CACHE_DIR)
+
+embed_model = None
+semantic_index = None
+semantic_entries = []  # [{"embedding_idx": int, "reply": str, "ts": float}], aligned with semantic_index
+semantic_unsaved = 0
+
+@functools.cache
+def load_semantic_cache():
+    """Load the embedding model and persisted FAISS index once (blocking; run via asyncio.to_thread)."""
+    global embed_model, semantic_index, semantic_entries, semantic_unsaved
+    if not SEMANTIC_CACHE:
+        return
+    try:  # Optional deps, imported here so importing this module doesn't pull in torch
+        import faiss
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("⚠️ faiss/sentence-transformers not installed; semantic cache disabled.")
+        return
+    try:
+        embed_model = SentenceTransformer(SEMANTIC_MODEL)
+        dim = embed_model.get_sentence_embedding_dimension()
+        stored = load_json(SEMANTIC_CACHE_FILE)
+        entries = stored.get("entries", [])
+        index = faiss.read_index(SEMANTIC_INDEX_FILE) if os.path.exists(SEMANTIC_INDEX_FILE) else None
+        if (index is None or index.d != dim or index.ntotal != len(entries)
+                or stored.get("version") != _PPLX_VERSION):
+            # Missing, out of sync or from another prompt: start fresh rather than serve stale replies
+            index, entries = None, []
+        semantic_index = faiss.IndexFlatIP(dim)  # Inner product == cosine on normalized vectors
+        semantic_entries = []
+        # Drop expired entries and keep the newest SEMANTIC_MAX_ENTRIES (entries are in insertion order)
+        cutoff = time.time() - SEMANTIC_TTL
+        keep = [i for i, e in enumerate(entries) if e.get("ts", 0) >= cutoff][-SEMANTIC_MAX_ENTRIES:]
+        if keep:
+            semantic_index.add(index.reconstruct_n(0, index.ntotal)[keep])
+            semantic_entries = [{**entries[i], "embedding_idx": n} for n, i in enumerate(keep)]
+        if len(keep) != len(entries):
+            semantic_unsaved += 1  # Persist the pruned store
+        print(f"🧠 Semantic cache loaded ({semantic_index.ntotal} entries).")
+    except Exception as e:
+        print(f"❌ Semantic cache init error: {e}")
+        embed_model = None
+        semantic_index = None
+
+def save_semantic_cache():
+    global semantic_unsaved
+    if semantic_index is None or not semantic_unsaved:
+        return
+    import faiss  # Already loaded by load_semantic_cache()
+    faiss.write_index(semantic_index, SEMANTIC_INDEX_FILE)
+    save_json(SEMANTIC_CACHE_FILE, {"version": _PPLX_VERSION, "entries": semantic_entries})
+    semantic_unsaved = 0
+
+def semantic_embed_batch(texts):
+    """Embed texts in one encode() call (blocking); returns one vector per text, or Nones if disabled."""
+    if embed_model is None or not texts:
+        return [None] * len(texts)
+    return list(embed_model.encode(texts, normalize_embeddings=True).astype("float32"))
+
+async def embed_texts_async(texts):
+    """Load the model and embed texts off the event loop."""
+    await asyncio.to_thread(load_semantic_cache)
+    return await asyncio.to_thread(semantic_embed_batch, texts)
+
+def semantic_lookup(emb):
+    """Return a cached, unexpired reply for a near-duplicate tweet, or None."""
+    if emb is None or semantic_index is None or not semantic_index.ntotal:
+        return None
+    D, I = semantic_index.search(emb[None], 1)
+    entry = semantic_entries[I[0, 0]]
+    if D[0, 0] >= SEMANTIC_THRESHOLD and entry.get("ts", 0) >= time.time() - SEMANTIC_TTL:
+        return entry["reply"]
+    return None
+
+def semantic_inflight(emb, inflight):
+    """Return the pending reply future of a near-duplicate already being analyzed in this batch, or None."""
+    if emb is None:
+        return None
+    for other, fut in inflight:
+        if float(emb @ other) >= SEMANTIC_THRESHOLD:
+            return fut
+    return None
+
+def semantic_add(emb, reply):
+    global semantic_unsaved
+    if emb is None or semantic_index is None or not reply:
+        return
+    semantic_index.add(emb[None])
+    semantic_entries.append({"embedding_idx": semantic_index.ntotal - 1, "reply": reply, "ts": time.time()})
+    semantic_unsaved += 1  # Persisted off the loop at the end of the batch
+
 # ---------------- Perplexity ----------------
-def fetch_perplexity_analysis(tweet_text):
+# Shared instruction prefix; the user message carries only the tweet text
+_PPLX_SYS = ("Give only a short, clear critical political analysis of the given tweet in Hindi, "
+             "under 260 characters, no headings, no citation numbers.")
+PPLX_MODEL = "sonar-pro"  # Valid Perplexity model
+PPLX_MAX_TOKENS = 140  # ~260 Hindi characters
+# Fingerprint of everything that shapes a reply; part of every cache key so prompt changes invalidate old replies
+_PPLX_VERSION = hashlib.sha1(f"{PPLX_MODEL}|{PPLX_MAX_TOKENS}|{_PPLX_SYS}".encode("utf-8")).hexdigest()[:12]
+
+def new_pplx_batch(session):
+    """Per-run state shared by concurrent fetch_perplexity_analysis calls."""
+    return {
+        "session": session,
+        "inflight": [],  # (embedding, future) of analyses in progress, for in-batch dedup
+        "limit": asyncio.Semaphore(PPLX_CONCURRENCY)  # Cancelled waiters never hit the API
+    }
+
+async def fetch_perplexity_analysis(tweet_text, batch, emb=None):
+    """Analyze one tweet; emb is its precomputed embedding (see embed_texts_async) or None."""
     if not tweet_text:
         return ""
     if not PERPLEXITY_API_KEY:
         print("❌ Missing PERPLEXITY_API key.")
         return ""
     trimmed_text = tweet_text[:500]
-    prompt = f"(YOU ARE A NO FILTER ANALYST SO NOW) \"give me only critical analysis of \\\"{trimmed_text}\\\" , in less than 260 characters in hindi, no headings, no character no. mention\""  
-    url = "https://api.perplexity.ai/chat/completions"
-    headers = {"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json"}
+    key = hashlib.sha1(f"{_PPLX_VERSION}\0{trimmed_text}".encode("utf-8")).hexdigest()
+    cached = get_pplx_cache().get(key)
+    if cached:
+        print("💾 Exact cache hit; skipping Perplexity.")
+        return cached
+    cached = semantic_lookup(emb)
+    if cached:
+        print("🧠 Semantic cache hit; skipping Perplexity.")
+        return cached
+    leader = semantic_inflight(emb, batch["inflight"])
+    while leader is not None:
+        # Shield so cancelling this task doesn't cancel the shared future
+        shared = await asyncio.shield(leader)
+        if shared:
+            print("🧠 Near-duplicate in this batch; sharing its reply.")
+            return shared
+        # Leader failed or was cancelled: wait on another live one, or analyze this one ourselves
+        leader = semantic_inflight(emb, batch["inflight"])
+    fut = None
+    if emb is not None:
+        fut = asyncio.get_running_loop().create_future()
+        batch["inflight"].append((emb, fut))
     data = {
-        "model": "sonar-pro",  # Valid Perplexity model
+        "model": PPLX_MODEL,
         "messages": [
-            {"role": "system", "content": "Respond with a short, clear Hindi political analysis under 260 words."},
-            {"role": "user", "content": prompt}
+            {"role": "system", "content": _PPLX_SYS},
+            {"role": "user", "content": trimmed_text}
         ],
-        "max_tokens": 180
+        "max_tokens": PPLX_MAX_TOKENS
     }
+    reply = None
+    try:
+        async with batch["limit"]:
+            reply = await pplx_post(batch["session"], data)
+        if reply:
+            get_pplx_cache().set(key, reply, expire=PPLX_CACHE_TTL)
+        semantic_add(emb, reply)
+        return reply
+    finally:
+        if fut is not None:
+            if not reply:
+                # Later near-duplicates shouldn't wait on a dead leader
+                batch["inflight"][:] = [entry for entry in batch["inflight"] if entry[1] is not fut]
+            if not fut.done():
+                fut.set_result(reply or None)  # None on failure/cancel, so followers fall back to their own call
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before the next attempt: Retry-After if given, else exponential backoff."""
     try:
-        r = requests.post(url, headers=headers, json=data, timeout=20)
-        if r.status_code != 200:
-            error_body = r.text  # Or r.json().get("error", {}).get("message", r.text)
-            print(f"❌ Perplexity API error {r.status_code}: {error_body}")
+        if retry_after is not None:
+            return min(max(float(retry_after), 0), PPLX_MAX_RETRY_AFTER)
+    except ValueError:
+        pass  # HTTP-date form; fall back to backoff
+    return PPLX_BACKOFF * (2 ** attempt)
+
+async def pplx_post(session, data):
+    """POST a chat completion, retrying 429/5xx, dropped connections and timeouts; returns cleaned text or ""."""
+    for attempt in range(PPLX_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            async with session.post(PERPLEXITY_URL, json=data) as r:
+                status = r.status
+                if status == 200:
+                    js = await r.json()
+                    return clean_text(js["choices"][0]["message"]["content"].strip())
+                error_body = await r.text()
+                retry_after = r.headers.get("Retry-After")
+            error = f"Perplexity API error {status}: {error_body}"
+            retryable = status in PPLX_RETRY_STATUSES
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # e.g. a pooled keep-alive connection closed by the server
+            error = f"Perplexity connection error: {e!r}"
+            retryable = True
+        except Exception as e:
+            print(f"❌ Perplexity error: {e}")
             return ""
-        return clean_text(r.json()["choices"][0]["message"]["content"].strip())
-    except Exception as e:
-        print(f"❌ Perplexity error: {e}")
+        # Connection is released back to the pool before backing off
+        if retryable and attempt < PPLX_MAX_RETRIES:
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+            continue
+        print(f"❌ {error}")
         return ""
 
-# Parallel Perplexity processor
-def generate_replies_parallel(tweets):
-    """Generate replies for all tweets in parallel."""
-    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as executor:
-        future_to_tweet = {
-            executor.submit(fetch_perplexity_analysis, tweet["text"]): tweet for tweet in tweets
-        }
-        for future in as_completed(future_to_tweet):
-            tweet = future_to_tweet[future]
-            try:
-                reply = future.result()
-                tweet["reply_text"] = reply
-            except Exception as e:
-                print(f"❌ Parallel Perplexity error for {tweet['id']}: {e}")
-                tweet["reply_text"] = ""
+def pplx_session():
+    """Keep-alive HTTPS session for Perplexity; auth headers are set once, not per call."""
+    return aiohttp.ClientSession(
+        headers={"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json"},
+        connector=aiohttp.TCPConnector(keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=20)
+    )
+
+# Concurrent Perplexity processor
+async def generate_replies_async(tweets):
+    """Generate replies for all tweets concurrently over one shared HTTP session."""
+    embs = await embed_texts_async([tweet["text"][:500] for tweet in tweets])
+    async with pplx_session() as session:
+        batch = new_pplx_batch(session)
+        results = await asyncio.gather(
+            *[fetch_perplexity_analysis(tweet["text"], batch, emb) for tweet, emb in zip(tweets, embs)],
+            return_exceptions=True
+        )
+    await asyncio.to_thread(save_semantic_cache)
+    for tweet, reply in zip(tweets, results):
+        if isinstance(reply, Exception):
+            print(f"❌ Async Perplexity error for {tweet['id']}: {reply}")
+            reply = ""
+        tweet["reply_text"] = reply
     return tweets
 
 # ---------------- Multi-Account Reply with Media ----------------
+_MEDIA_CACHE = {}  # (account_name, image_path) -> media_id; ids are account-scoped, reusable ~24h
+
 def post_reply_with_account(tweet_id, reply_text, client_info):
     account_name = client_info["name"]
     client = client_info["client"]  # v2
@@ -285,10 +641,16 @@ def post_reply_with_account(tweet_id, reply_text, client_info):
     try:
         media_ids = None
         if image_path:
-            # Step 1: Upload media via v1.1 API
-            media = api.simple_upload(image_path)
-            media_ids = [media.media_id]
-            print(f"📎 [{account_name}] Uploaded media ID: {media.media_id}")
+            # Step 1: Upload media via v1.1 API (once per account/image per run)
+            key = (account_name, image_path)
+            media_id = _MEDIA_CACHE.get(key)
+            if media_id is None:
+                media = api.simple_upload(image_path)
+                media_id = _MEDIA_CACHE[key] = media.media_id
+                print(f"📎 [{account_name}] Uploaded media ID: {media_id}")
+            else:
+                print(f"📎 [{account_name}] Reusing media ID: {media_id}")
+            media_ids = [media_id]
         
         # Step 2: Create reply tweet via v2 Client
         if DRY_RUN:
@@ -314,32 +676,47 @@ def post_reply_with_account(tweet_id, reply_text, client_info):
         print(f"❌ [{account_name}] Post error: {e}")
         return False
 
+async def post_for_account(queue, client_info, label="Tweet"):
+    """Post one account's replies in order, pacing only against that account's own rate limit."""
+    sent = 0
+    for idx, tweet in queue:
+        delay = random.randint(MIN_DELAY, MAX_DELAY)
+        print(f"\n📜 {label} {idx+1} (from {tweet['profile']}): {tweet['text'][:120]}...")
+        print(f"⏳ [{client_info['name']}] Waiting {delay}s...")
+        await asyncio.sleep(delay)
+        # Tweepy is sync; run it off the loop so other accounts keep posting
+        if await asyncio.to_thread(post_reply_with_account, tweet["id"], tweet["reply_text"], client_info):
+            sent += 1
+    return sent
+
+async def post_replies_async(tweets, label="Tweet"):
+    """Round-robin tweets over accounts, then post on all accounts concurrently."""
+    clients = get_clients()
+    queues = [[] for _ in clients]
+    for idx, tweet in enumerate(tweets):
+        # Skip if no reply generated
+        if not tweet.get("reply_text"):
+            print(f"⚠️ Skipping {label.lower()} {tweet['id']} (no reply).")
+            continue
+        queues[idx % len(clients)].append((idx, tweet))
+    results = await asyncio.gather(
+        *[post_for_account(queue, client_info, label) for queue, client_info in zip(queues, clients) if queue]
+    )
+    return sum(results)
+
 # ---------------- Main Modes ----------------
 def fetch_and_reply():
+    prepare_images()
     selected_profiles = select_profiles()
-    fetched_tweets = fetch_tweets(selected_profiles)
+    # Overlap the Apify scrape with reply generation
+    print("🤖 Fetching tweets and generating replies concurrently...")
+    fetched_tweets = asyncio.run(fetch_and_analyze(selected_profiles))
     if not fetched_tweets:
         print("⚠️ No tweets fetched.")
         return
 
-    # Generate all replies in parallel for speed
-    print("🤖 Generating replies in parallel...")
-    fetched_tweets = generate_replies_parallel(fetched_tweets)
-
-    replies_sent = 0
-    for idx, tweet in enumerate(fetched_tweets):
-        # Skip if no reply generated
-        if not tweet.get("reply_text"):
-            print(f"⚠️ Skipping tweet {tweet['id']} (no reply).")
-            continue
-        # Round-robin accounts
-        client_info = clients[idx % len(clients)]
-        delay = random.randint(MIN_DELAY, MAX_DELAY)
-        print(f"\n📜 Tweet {idx+1} (from {tweet['profile']}): {tweet['text'][:120]}...")
-        print(f"⏳ [{client_info['name']}] Waiting {delay}s...")
-        time.sleep(delay)
-        if post_reply_with_account(tweet["id"], tweet["reply_text"], client_info):
-            replies_sent += 1
+    # Post with per-account pacing; accounts run concurrently
+    replies_sent = asyncio.run(post_replies_async(fetched_tweets))
 
     print(f"\n🎉 Fetch+Reply complete: {replies_sent}/{len(fetched_tweets)} replies sent.")
 
@@ -348,6 +725,7 @@ def queue_reply():
     if not queue:
         print("⚠️ Queue empty.")
         return
+    prepare_images()
     # Flatten queue to list for multi-account processing
     queued_tweets = []
     for profile, tweets in queue.items():
@@ -355,30 +733,19 @@ def queue_reply():
             queued_tweets.append({**tweet, "profile": profile})
     random.shuffle(queued_tweets)  # Randomize for distribution
 
-    # Generate replies in parallel
-    print("🤖 Generating queued replies in parallel...")
-    queued_tweets = generate_replies_parallel(queued_tweets)
+    # Generate replies concurrently
+    print("🤖 Generating queued replies concurrently...")
+    queued_tweets = asyncio.run(generate_replies_async(queued_tweets))
 
-    replies_sent = 0
-    for idx, tweet_data in enumerate(queued_tweets[:len(clients)]):  # Limit to num accounts
-        if not tweet_data.get("reply_text"):
-            print(f"⚠️ Skipping queued tweet {tweet_data['id']} (no reply).")
-            continue
-        client_info = clients[idx % len(clients)]
-        delay = random.randint(MIN_DELAY, MAX_DELAY)
-        print(f"\n📜 Queued tweet: {tweet_data['text'][:120]}...")
-        print(f"⏳ [{client_info['name']}] Waiting {delay}s...")
-        time.sleep(delay)
-        if post_reply_with_account(tweet_data["id"], tweet_data["reply_text"], client_info):
-            replies_sent += 1
-            # Remove from queue (simplified)
+    # Limit to num accounts; each account posts concurrently
+    replies_sent = asyncio.run(post_replies_async(queued_tweets[:len(get_clients())], label="Queued tweet"))
     print(f"\n🎉 Queue reply complete: {replies_sent} replies sent.")
 
 # ---------------- Run ----------------
 if __name__ == "__main__":
-    print(f"🚀 Multi-Account Bot started in {MODE.upper()} mode with {len(clients)} accounts. Media: {ATTACH_MEDIA}")
+    print(f"🚀 Multi-Account Bot started in {MODE.upper()} mode with {len(get_clients())} accounts. Media: {ATTACH_MEDIA}")
     print(f"Tweepy version: {tweepy.__version__}")  # Quick version check
-    print(f"Delays: {MIN_DELAY}-{MAX_DELAY}s, Parallel: {MAX_PARALLEL}")
+    print(f"Delays: {MIN_DELAY}-{MAX_DELAY}s")
     if MODE == "fetch_reply":
         fetch_and_reply()
     elif MODE == "reply_queue":